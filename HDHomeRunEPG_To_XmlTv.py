@@ -7,7 +7,8 @@ to an HDHomeRun Quattro.  The HDHomeRun Quattro hardware automatically maintains
 the channels it has tuned in, so it made sense to use this.
 
 The HDHomeRun Quattro has a limitation of just over 7 days EPG, so trying to go beyond that
-is pointless.
+is pointless.  Extraction stops early once a few consecutive requests past the furthest
+programme returned add nothing new, and programmes that have already finished are dropped.
 
 Fixes:
 
@@ -17,6 +18,8 @@ Fixes:
 
 import argparse
 import datetime
+import json
+import os
 import re
 import requests
 from requests.adapters import HTTPAdapter
@@ -24,6 +27,7 @@ import ssl
 import sys
 import xml.etree.ElementTree as ET
 import unicodedata
+from epg_profiler import Profiler, profiling_enabled, profile_directory
 
 __author__ = "Incubus Victim"
 __credits__ = ["Incubus Victim"]
@@ -37,6 +41,7 @@ epgFilename = "epg.xml"
 scheduleDurationInDays = 7
 hoursIncrement = 3
 showlog_info = "on"
+staleWindowLimit = 2
 
 # Create an adapter that forces TLS v1.2
 class TLS12Adapter(HTTPAdapter):
@@ -80,6 +85,17 @@ def log_info(text):
 def log_detail(text):
     log("DETAIL", text)
 
+def snapshot_filename(epgFilename: str, suffix: str) -> str:
+    # Snapshot files sit next to the EPG, e.g. epg.xml -> epg.lineup.json
+    return os.path.splitext(epgFilename)[0] + suffix
+
+def write_json(filename: str, data):
+    # Write to a temporary file first so the web server never reads a partial snapshot
+    tmpFilename = filename + ".tmp"
+    with open(tmpFilename, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmpFilename, filename)
+
 # Set up all the command line parameters
 parser = argparse.ArgumentParser(add_help=False, description="Program to download the HDHomeRun device EPG and convert it to an XMLTV format suitable for Jellyfin.")
 parser.add_argument("--help", action="store_true", help="Show the command parameters available.")
@@ -88,6 +104,8 @@ parser.add_argument("--filename", help="The file path and name of the EPG to be
 parser.add_argument("--days", help="The number of days in the future from now to obtain an EPG for. Defaults to 7 but will be restricted to a max of about 14 by the HDHomeRun device.")
 parser.add_argument("--hours", help="The number of hours of guide interation to obtain. Defaults to 3 hours.")
 parser.add_argument("--debug", help="Switch debug log message on, options are \"on\", \"full\" or \"off\". Defaults to \"on\"")
+parser.add_argument("--profile", action="store_true", help="Write cProfile and tracemalloc reports for each stage. Can also be enabled with EPG_PROFILE=1.")
+parser.add_argument("--profile-dir", help="The directory profiling reports are written to. Defaults to a \"profiles\" directory next to the EPG file.")
 showHelp = False
 try:
     args = parser.parse_args()
@@ -111,11 +129,18 @@ if (args.debug != None and args.debug.lower() == "off"):
 if (args.debug != None and args.debug.lower() == "full"):
     showlog_info = "full"
 
+# Optional per stage profiling
+profileDir = args.profile_dir if args.profile_dir != None else profile_directory(epgFilename)
+profiler = Profiler(profileDir, "generator", enabled=profiling_enabled(args.profile))
+if profiler.enabled:
+    log_info("Profiling enabled, reports run " + profiler.new_run() + " will be written to " + str(profileDir))
+
 # Construct the HDHomeRun info Url's
 deviceUrl = "http://" + urlHost + "/discover.json"
 lineUpUrl = "http://" + urlHost + "/lineup.json"
 
 log_info("---------- Fetching HDHomeRun Web API Device Auth ----------")
+profiler.begin("discover")
 
 # Set up the session with the custom TLS 1.2 adapter
 session = requests.Session()
@@ -130,6 +155,7 @@ deviceJson = deviceResp.json()
 deviceAuth = deviceJson["DeviceAuth"]
 
 log_info("---------- Fetching HDHomeRun Web API Lineup ----------")
+profiler.begin("lineup")
 
 # Get the HDHomeRun channel line up info
 lineUpResp = requests.get(lineUpUrl)
@@ -139,6 +165,8 @@ if lineUpResp.status_code != 200:
 lineUpJson = lineUpResp.json()
 
 log_info("---------- HDHomeRun RPG Extraction Started ----------")
+profiler.begin("fetch")
+fetchStarted = datetime.datetime.now()
 
 # Prepare to process the HDHomeRun Guide
 timestamp1Day = 86400
@@ -155,6 +183,15 @@ if deviceResp.status_code != 200:
     sys.exit()
 
 baseGuideJson = guideResp.json()
+fetchRequests = 1
+
+# Track the furthest programme end returned for each channel
+channelGuideEnd = {}
+for baseChannel in baseGuideJson:
+    for baseGuideItem in baseChannel["Guide"]:
+        if baseGuideItem["EndTime"] > channelGuideEnd.get(baseChannel["GuideNumber"], 0):
+            channelGuideEnd[baseChannel["GuideNumber"]] = baseGuideItem["EndTime"]
+staleWindows = 0
 
 nextTimestamp = int(nextTimestamp + timestampIncrementHrs)
 
@@ -167,12 +204,14 @@ while nextTimestamp <= maxTimestamp:
     if deviceResp.status_code != 200:
         log_info("HDHomeRun guide request failed: (" + deviceResp.status_code + ") " + deviceResp.reason)
         sys.exit()
+    fetchRequests += 1
 
     reqGuideJson = guideResp.json()
 
     if reqGuideJson == None:
         break
-    
+
+    windowAdvanced = False
     for reqChannel in reqGuideJson:
 
         channelText = reqChannel["GuideName"]
@@ -201,17 +240,47 @@ while nextTimestamp <= maxTimestamp:
                     baseChannel["Guide"].append(reqGuideItem)
                     log_detail("------> Appending: " + reqGuideItem["Title"] + " from " + str(reqGuideItem["StartTime"]) + " to " + str(reqGuideItem["EndTime"]))
 
+                if reqGuideItem["EndTime"] > channelGuideEnd.get(reqChannel["GuideNumber"], 0):
+                    channelGuideEnd[reqChannel["GuideNumber"]] = reqGuideItem["EndTime"]
+                    windowAdvanced = True
+
+    # Stop once requests past the furthest programme keep returning nothing new
+    if windowAdvanced:
+        staleWindows = 0
+    elif nextTimestamp >= max(channelGuideEnd.values(), default=0):
+        staleWindows += 1
+        if staleWindows >= staleWindowLimit:
+            log_info("--> No new programmes in the last " + str(staleWindows) + " requests, stopping at the guide horizon")
+            break
+
     nextTimestamp = int(nextTimestamp + timestampIncrementHrs)
 
+# Drop programmes that have already finished
+nowTimestamp = int(datetime.datetime.now().timestamp())
+trimmedProgrammes = 0
+for baseChannel in baseGuideJson:
+    currentGuide = [baseGuideItem for baseGuideItem in baseChannel["Guide"] if baseGuideItem["EndTime"] > nowTimestamp]
+    trimmedProgrammes += len(baseChannel["Guide"]) - len(currentGuide)
+    baseChannel["Guide"] = currentGuide
+log_info("--> Trimmed " + str(trimmedProgrammes) + " programmes that have already finished")
+
+if len(channelGuideEnd) > 0:
+    guideHorizon = max(channelGuideEnd.values())
+    log_info("--> Guide horizon reached " + str(datetime.datetime.fromtimestamp(guideHorizon)) + " (" + str(round((guideHorizon - nowTimestamp) / 3600, 1)) + " hours) after " + str(fetchRequests) + " requests")
+
+fetchDuration = datetime.datetime.now() - fetchStarted
+profiler.end()
 log_info("---------- HDHomeRun RPG Extraction Completed ----------")
 
 log_info("---------- HDHomeRun XMLTV Transformation Started ----------")
+profiler.begin("transform")
 
 tv = ET.Element("tv")
 tv.set("generator-info-name", "HDHomeRun")
 tv.set("generator-info-url", deviceUrl)
 
 # Scan through all Channels adding them to the XML document
+lineUpChannels = []
 for reqChannel in baseGuideJson:
 
     # Channel
@@ -229,6 +298,8 @@ for reqChannel in baseGuideJson:
     channelName.set("lang", "en")
     channelName.text = guideName
 
+    lineUpChannels.append({"GuideNumber": reqChannel["GuideNumber"], "GuideName": guideName, "URL": "http://" + urlHost + ":5004/auto/v" + reqChannel["GuideNumber"]})
+
     # Channel logo url
     if "ImageURL" in reqChannel:
         channelLogo = ET.SubElement(channel, "icon")
@@ -236,9 +307,18 @@ for reqChannel in baseGuideJson:
         channelLogo.text = ""
 
 # Scan through all Programmes adding them to the XML document
+programmeCount = 0
+guideStart = None
+guideEnd = None
 for reqChannel in baseGuideJson:
     for reqGuide in reqChannel["Guide"]:
 
+        programmeCount += 1
+        if guideStart == None or reqGuide["StartTime"] < guideStart:
+            guideStart = reqGuide["StartTime"]
+        if guideEnd == None or reqGuide["EndTime"] > guideEnd:
+            guideEnd = reqGuide["EndTime"]
+
         # Programme
         programme = ET.SubElement(tv, "programme")
         startTime = datetime.datetime.fromtimestamp(reqGuide["StartTime"]).astimezone().strftime("%Y%m%d%H%M%S %z")
@@ -300,11 +380,40 @@ for reqChannel in baseGuideJson:
                 category.set("lang", "en")
                 category.text = filter
 
+profiler.end()
 log_info("---------- HDHomeRun XMLTV Transformation Completed ----------")
 
 log_info("---------- Writing XMLTV to file " + epgFilename + " Started ----------")
 
 # Create the XMLTV file
+profiler.begin("write")
 data = ET.ElementTree(tv).write(epgFilename, encoding='utf-8')
+profiler.end()
 
 log_info("---------- Writing XMLTV to file " + epgFilename + " Completed ----------")
+
+log_info("---------- Publishing lineup and status snapshots Started ----------")
+
+# Publish the lineup and a status summary so the web server does not have to parse the EPG.
+# The status is written last, its generation id tells the server a new EPG is complete.
+profiler.begin("publish")
+generatedAt = datetime.datetime.now().astimezone()
+statusJson = {
+    "generation_id": generatedAt.strftime("%Y%m%d%H%M%S%f"),
+    "generated_at": generatedAt.isoformat(),
+    "epg_file_size": os.path.getsize(epgFilename),
+    "channel_count": len(lineUpChannels),
+    "programme_count": programmeCount,
+    "guide_start": datetime.datetime.fromtimestamp(guideStart).astimezone().isoformat() if guideStart != None else None,
+    "guide_end": datetime.datetime.fromtimestamp(guideEnd).astimezone().isoformat() if guideEnd != None else None,
+    "guide_horizon_hours": round((guideEnd - generatedAt.timestamp()) / 3600, 1) if guideEnd != None else 0,
+    "fetch_duration_seconds": round(fetchDuration.total_seconds(), 2),
+    "fetch_requests": fetchRequests,
+    "programmes_trimmed": trimmedProgrammes
+}
+write_json(snapshot_filename(epgFilename, ".lineup.json"), lineUpChannels)
+write_json(snapshot_filename(epgFilename, ".status.json"), statusJson)
+profiler.end()
+
+log_info("Published " + str(statusJson["channel_count"]) + " channels and " + str(programmeCount) + " programmes, generation " + statusJson["generation_id"])
+log_info("---------- Publishing lineup and status snapshots Completed ----------")
@@ -40,6 +40,9 @@ FULL_CMD="$EPG_CMD"
     echo "HDHOMERUN_HOST=$HDHOMERUN_HOST"
     echo "OUTPUT_FILENAME=$OUTPUT_FILENAME"
     echo "DAYS=$DAYS"
+    [ -n "$EPG_PROFILE" ] && echo "EPG_PROFILE=$EPG_PROFILE"
+    [ -n "$EPG_PROFILE_DIR" ] && echo "EPG_PROFILE_DIR=$EPG_PROFILE_DIR"
+    [ -n "$EPG_PROFILE_KEEP" ] && echo "EPG_PROFILE_KEEP=$EPG_PROFILE_KEEP"
     echo "$CRON_SCHEDULE $FULL_CMD >> /var/log/cron.log 2>&1"
 ) | crontab -
 
@@ -103,6 +106,7 @@ echo "Days: $DAYS"
 echo "Schedule: $CRON_SCHEDULE"
 echo "Timezone: $TZ"
 echo "Run on start: $RUN_ON_START"
+echo "Profiling: ${EPG_PROFILE:-off}"
 echo "==========================================="
 echo ""
 echo "EPG ENDPOINTS AVAILABLE:"
@@ -0,0 +1,150 @@
+"""
+EPG Profiler
+Opt-in cProfile/tracemalloc reporting shared by the EPG generator and the HTTP server.
+
+Profiling is switched on with --profile (generator) or EPG_PROFILE=1 (both). Each
+profiled section writes a binary cProfile dump (.prof, loadable with pstats or
+snakeviz) and a text report with the top functions by cumulative time and the top
+tracemalloc allocations into the profiles directory. Only the newest runs are kept.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_KEEP = 20
+DEFAULT_TOP = 25
+
+
+def profiling_enabled(flag=False):
+    """Return True if profiling was requested on the command line or via EPG_PROFILE"""
+    return bool(flag) or os.environ.get('EPG_PROFILE', '').lower() in ['1', 'true', 'yes', 'on']
+
+
+def env_int(name, default):
+    """Read an integer setting from the environment, falling back to default if unset or invalid"""
+    try:
+        return int(os.environ.get(name, ''))
+    except ValueError:
+        return default
+
+
+def profile_directory(epg_filename):
+    """Profiles directory, EPG_PROFILE_DIR or a 'profiles' folder next to the EPG file"""
+    if os.environ.get('EPG_PROFILE_DIR'):
+        return Path(os.environ['EPG_PROFILE_DIR'])
+    return Path(epg_filename).resolve().parent / 'profiles'
+
+
+class Profiler:
+    """Profiles named sections of a run and writes one report per section
+
+    Files are named <prefix>-<run id>-<section>.prof/.txt, where the run id is a
+    sortable timestamp. Sections sharing a run id are pruned together so that
+    the newest `keep` runs survive.
+    """
+
+    def __init__(self, directory, prefix, enabled=True, keep=None, top=DEFAULT_TOP):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.enabled = enabled
+        if keep is None:
+            keep = env_int('EPG_PROFILE_KEEP', DEFAULT_KEEP) if enabled else DEFAULT_KEEP
+        self.keep = keep
+        self.top = top
+        self.run_id = None
+        self._section = None
+        self._profile = None
+        self._started_tracemalloc = False
+
+    def new_run(self):
+        """Start a new run id, later sections are grouped under it"""
+        self.run_id = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        return self.run_id
+
+    def begin(self, section):
+        """Start profiling a section, ending any section still open"""
+        if not self.enabled:
+            return
+        if self._section is not None:
+            self.end()
+        if self.run_id is None:
+            self.new_run()
+
+        self._section = re.sub(r'[^A-Za-z0-9_.]+', '_', section).strip('_') or 'section'
+        self._started_tracemalloc = not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def end(self):
+        """Stop the current section and write its reports, returns the text report path"""
+        if not self.enabled or self._section is None:
+            return None
+
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        try:
+            report_path = self._write(self._profile, snapshot, current, peak)
+            self.prune()
+        finally:
+            self._section = None
+            self._profile = None
+        return report_path
+
+    def _write(self, profile, snapshot, current, peak):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        base = self.directory / f"{self.prefix}-{self.run_id}-{self._section}"
+
+        profile.dump_stats(str(base) + '.prof')
+
+        stream = io.StringIO()
+        stream.write(f"Profile: {self.prefix} / {self._section} (run {self.run_id})\n")
+        stream.write(f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n\n")
+
+        stream.write(f"Top {self.top} functions by cumulative time\n")
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        stream.write(f"Top {self.top} allocations by line\n")
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            stream.write(f"{stat}\n")
+
+        report_path = Path(str(base) + '.txt')
+        report_path.write_text(stream.getvalue(), encoding='utf-8')
+        return report_path
+
+    def prune(self):
+        """Remove all but the newest `keep` runs for this prefix"""
+        if self.keep <= 0 or not self.directory.exists():
+            return
+
+        pattern = re.compile(re.escape(self.prefix) + r'-(\d{8}-\d{6}-\d{6})-')
+        runs = {}
+        for path in self.directory.iterdir():
+            match = pattern.match(path.name)
+            if match:
+                runs.setdefault(match.group(1), []).append(path)
+
+        for run_id in sorted(runs, reverse=True)[self.keep:]:
+            for path in runs[run_id]:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
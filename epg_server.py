@@ -5,12 +5,14 @@ Serves EPG XML files via HTTP endpoint
 """
 
 import os
+import sys
 import logging
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
 import mimetypes
 import json
 from datetime import datetime
+from epg_profiler import Profiler, env_int, profiling_enabled, profile_directory
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,7 +20,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Endpoints recognised by the handler, used to name profiling samples
+KNOWN_ENDPOINTS = {
+    '/': 'index',
+    '/epg.xml': 'epg.xml',
+    '/xmltv.xml': 'xmltv.xml',
+    '/guide.xml': 'guide.xml',
+    '/lineup.json': 'lineup.json',
+    '/status': 'status',
+    '/health': 'health',
+}
+
+class GenerationSnapshot:
+    """Lineup and status summary published by the generator next to the EPG
+
+    The snapshot files are re-read only when the generation changes, so the
+    lineup and status endpoints never need to parse or stat the EPG itself.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget the cached generation"""
+        self.epg_path = None
+        self.status_key = None
+        self.generation_id = None
+        self.status = None
+        self.lineup_bytes = None
+        self.epg_last_modified = None
+
+    def refresh(self, epg_path):
+        """Reload the snapshot if a new generation was published, returns True if one is available"""
+        status_path = epg_path.with_name(epg_path.stem + '.status.json')
+        try:
+            stat = status_path.stat()
+        except OSError:
+            # Status removed, drop the cached generation so callers fall back to the EPG file
+            self.clear()
+            return False
+
+        status_key = (stat.st_mtime_ns, stat.st_size)
+        if epg_path == self.epg_path and status_key == self.status_key:
+            return self.status is not None
+
+        try:
+            status = json.loads(status_path.read_text(encoding='utf-8'))
+            if epg_path != self.epg_path or status.get('generation_id') != self.generation_id:
+                lineup_path = epg_path.with_name(epg_path.stem + '.lineup.json')
+                lineup_bytes = lineup_path.read_bytes()
+                json.loads(lineup_bytes)
+                self.lineup_bytes = lineup_bytes
+                self.epg_last_modified = datetime.fromtimestamp(epg_path.stat().st_mtime).isoformat()
+                self.generation_id = status.get('generation_id')
+                logger.info(f"Loaded EPG generation {self.generation_id}: {status.get('channel_count')} channels, {status.get('programme_count')} programmes")
+        except (OSError, ValueError) as e:
+            # Keep serving the previous generation, retry on the next request
+            logger.error(f"Error loading EPG snapshot: {e}")
+            return self.status is not None and epg_path == self.epg_path
+
+        self.status = status
+        self.status_key = status_key
+        self.epg_path = epg_path
+        return True
+
+snapshot = GenerationSnapshot()
+
 class EPGHandler(BaseHTTPRequestHandler):
+    # Request profiling, enabled by EPG_PROFILE=1 or --profile
+    profiling = False
+    profile_sample = 1
+    profilers = {}
+    request_counts = {}
+
     def do_HEAD(self):
         """Handle HEAD requests (required by Plex)"""
         self.handle_request(head_only=True)
@@ -35,6 +109,36 @@ class EPGHandler(BaseHTTPRequestHandler):
         path = parsed.path
         query = parse_qs(parsed.query)
 
+        if not self.profiling:
+            self.route_request(path, query, head_only)
+            return
+
+        # Sample every Nth request per endpoint
+        endpoint = KNOWN_ENDPOINTS.get(path, 'not_found')
+        count = EPGHandler.request_counts.get(endpoint, 0) + 1
+        EPGHandler.request_counts[endpoint] = count
+        if count % self.profile_sample != 0:
+            self.route_request(path, query, head_only)
+            return
+
+        profiler = self.get_profiler(endpoint)
+        profiler.new_run()
+        profiler.begin('HEAD' if head_only else 'GET')
+        try:
+            self.route_request(path, query, head_only)
+        finally:
+            report = profiler.end()
+            logger.info(f"Profiled {endpoint} request, report written to {report}")
+
+    def get_profiler(self, endpoint):
+        """Return the profiler for an endpoint, each endpoint keeps its own reports"""
+        if endpoint not in EPGHandler.profilers:
+            epg_path = os.environ.get('OUTPUT_FILENAME', '/output/epg.xml')
+            EPGHandler.profilers[endpoint] = Profiler(profile_directory(epg_path), f"server-{endpoint}")
+        return EPGHandler.profilers[endpoint]
+
+    def route_request(self, path, query, head_only=False):
+        """Dispatch a parsed request to its endpoint"""
         if path == '/':
             if not head_only:
                 self.send_index()
@@ -199,14 +303,33 @@ class EPGHandler(BaseHTTPRequestHandler):
         """Send server status as JSON"""
         epg_path = Path(os.environ.get('OUTPUT_FILENAME', '/output/epg.xml'))
 
+        generation = snapshot.status if snapshot.refresh(epg_path) else None
+        if generation is not None:
+            # These reflect the last published generation, not a fresh stat of the EPG file
+            epg_file_exists = True
+            epg_file_size = snapshot.status.get('epg_file_size', 0)
+            epg_last_modified = snapshot.epg_last_modified
+        else:
+            # No snapshot published yet (EPG from an older generator), fall back to the file itself
+            try:
+                epg_stat = epg_path.stat()
+                epg_file_exists = True
+                epg_file_size = epg_stat.st_size
+                epg_last_modified = datetime.fromtimestamp(epg_stat.st_mtime).isoformat()
+            except OSError:
+                epg_file_exists = False
+                epg_file_size = 0
+                epg_last_modified = None
+
         status = {
             'server': 'running',
-            'epg_file_exists': epg_path.exists(),
-            'epg_file_size': epg_path.stat().st_size if epg_path.exists() else 0,
-            'epg_last_modified': datetime.fromtimestamp(epg_path.stat().st_mtime).isoformat() if epg_path.exists() else None,
+            'epg_file_exists': epg_file_exists,
+            'epg_file_size': epg_file_size,
+            'epg_last_modified': epg_last_modified,
             'hdhomerun_host': os.environ.get('HDHOMERUN_HOST', 'not configured'),
             'update_schedule': os.environ.get('CRON_SCHEDULE', '0 3 * * *'),
-            'server_time': datetime.now().isoformat()
+            'server_time': datetime.now().isoformat(),
+            'generation': generation
         }
 
         json_response = json.dumps(status, indent=2)
@@ -222,12 +345,22 @@ class EPGHandler(BaseHTTPRequestHandler):
         """Send channel lineup in HDHomeRun JSON format for compatibility"""
         epg_path = Path(os.environ.get('OUTPUT_FILENAME', '/output/epg.xml'))
 
+        if snapshot.refresh(epg_path):
+            # Serve the lineup published with the current generation
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(snapshot.lineup_bytes)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(snapshot.lineup_bytes)
+            return
+
         if not epg_path.exists():
             self.send_error(404, "EPG data not available yet")
             return
 
         try:
-            # Parse EPG to extract channel list
+            # No snapshot published yet, parse EPG to extract channel list
             import xml.etree.ElementTree as ET
             tree = ET.parse(epg_path)
             root = tree.getroot()
@@ -404,9 +537,13 @@ def run_server(port=None):
     server_address = ('', port)
     httpd = HTTPServer(server_address, EPGHandler)
     logger.info(f"EPG HTTP Server starting on port {port}")
+    if EPGHandler.profiling:
+        logger.info(f"Request profiling enabled, sampling 1 in {EPGHandler.profile_sample} requests per endpoint")
     logger.info(f"Access EPG at: http://<your-server>:{port}/epg.xml")
     httpd.serve_forever()
 
 if __name__ == '__main__':
+    EPGHandler.profiling = profiling_enabled('--profile' in sys.argv[1:])
+    EPGHandler.profile_sample = max(1, env_int('EPG_PROFILE_SAMPLE', 1))
     port = int(os.environ.get('WEB_PORT', '8083'))
     run_server(port)
\ No newline at end of file